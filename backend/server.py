@@ -1,47 +1,73 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, status
+from fastapi.responses import ORJSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+import asyncio
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import List, Optional
 import uuid
-from datetime import datetime, timedelta
+import hashlib
+import time
+from datetime import datetime, timedelta, timezone
 import jwt
-from passlib.context import CryptContext
-from passlib.hash import bcrypt
+from cachetools import TTLCache
+import bcrypt
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=20,
+    minPoolSize=5,  # keep warm connections so the first request skips the handshake
+    serverSelectionTimeoutMS=3000,
+    connectTimeoutMS=3000,
+    retryWrites=True,
+    compressors="zstd,zlib",
+    tz_aware=True
+)
 db = client[os.environ['DB_NAME']]
 
 # Security
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+BCRYPT_ROUNDS = 12
+# Marks hashes of bcrypt(hex(sha256(password))); unprefixed hashes are legacy raw bcrypt
+PREHASH_PREFIX = "$sha256$"
 security = HTTPBearer()
 SECRET_KEY = "guardiao_secret_key_2025"
 ALGORITHM = "HS256"
+JWT_DECODE_OPTIONS = {"verify_aud": False, "verify_iss": False, "require": ["exp", "sub"]}
+
+# Short-lived cache of validated tokens: sha256(token) -> (User, exp timestamp)
+_tok_cache = TTLCache(maxsize=10000, ttl=30)
+
+def utc_now():
+    return datetime.now(timezone.utc)
 
 # Create the main app without a prefix
-app = FastAPI(title="GUARDIÃO API")
+app = FastAPI(title="GUARDIÃO API", default_response_class=ORJSONResponse)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
 # User Models
 class User(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex, alias="_id")
     email: str
     name: str
     role: str  # Síndico, Segurança, Administrador
     password_hash: str
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=utc_now)
     is_active: bool = True
 
 class UserCreate(BaseModel):
@@ -55,7 +81,10 @@ class UserLogin(BaseModel):
     password: str
 
 class UserResponse(BaseModel):
-    id: str
+    model_config = ConfigDict(populate_by_name=True)
+
+    # Read from Mongo's "_id", still exposed to clients as "id"
+    id: str = Field(alias="_id", serialization_alias="id")
     email: str
     name: str
     role: str
@@ -64,12 +93,14 @@ class UserResponse(BaseModel):
 
 # Visit Models
 class Visit(BaseModel):
-    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex, alias="_id")
     visitor_name: str
     visitor_document: str
     destination: str  # Apartamento/Casa número
     purpose: str
-    entry_time: datetime = Field(default_factory=datetime.utcnow)
+    entry_time: datetime = Field(default_factory=utc_now)
     exit_time: Optional[datetime] = None
     status: str = "pending"  # pending, approved, denied, completed
     approved_by: Optional[str] = None
@@ -88,7 +119,9 @@ class VisitUpdate(BaseModel):
     notes: Optional[str] = None
 
 class VisitResponse(BaseModel):
-    id: str
+    model_config = ConfigDict(populate_by_name=True)
+
+    id: str = Field(alias="_id", serialization_alias="id")
     visitor_name: str
     visitor_document: str
     destination: str
@@ -100,6 +133,11 @@ class VisitResponse(BaseModel):
     notes: Optional[str]
     created_by: str
 
+# Only ship the fields VisitResponse needs from Mongo
+VISIT_RESPONSE_PROJECTION = {
+    field.alias or name: 1 for name, field in VisitResponse.model_fields.items()
+}
+
 # Authentication Models
 class Token(BaseModel):
     access_token: str
@@ -107,18 +145,35 @@ class Token(BaseModel):
     user: UserResponse
 
 # Utility Functions
+def _prehash_password(password):
+    # bcrypt truncates at 72 bytes and stops at NUL; a hex digest avoids both
+    return hashlib.sha256(password.encode()).hexdigest().encode()
+
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    if hashed_password.startswith(PREHASH_PREFIX):
+        return bcrypt.checkpw(
+            _prehash_password(plain_password),
+            hashed_password[len(PREHASH_PREFIX):].encode()
+        )
+    # Legacy hashes were made from the raw password, which bcrypt truncated to 72 bytes
+    return bcrypt.checkpw(plain_password.encode()[:72], hashed_password.encode())
+
+def password_needs_rehash(hashed_password):
+    return not hashed_password.startswith(PREHASH_PREFIX)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    hashed = bcrypt.hashpw(_prehash_password(password), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
+    return PREHASH_PREFIX + hashed.decode()
+
+# Checked against when the email is unknown so both login paths cost one bcrypt
+_DUMMY_HASH = get_password_hash("guardiao_dummy_password")
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
-        expire = datetime.utcnow() + expires_delta
+        expire = utc_now() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(hours=24)
+        expire = utc_now() + timedelta(hours=24)
     to_encode.update({"exp": expire})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
@@ -129,62 +184,133 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    token = credentials.credentials
+    token_hash = hashlib.sha256(token.encode()).digest()
+    cached = _tok_cache.get(token_hash)
+    if cached is not None:
+        cached_user, exp = cached
+        if exp > time.time():
+            return cached_user
+        _tok_cache.pop(token_hash, None)
+
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM], options=JWT_DECODE_OPTIONS)
         user_id: str = payload.get("sub")
         if user_id is None:
             raise credentials_exception
     except jwt.PyJWTError:
         raise credentials_exception
     
-    user = await db.users.find_one({"id": user_id})
+    user = await db.users.find_one({"_id": user_id})
     if user is None:
         raise credentials_exception
-    return User(**user)
+    user_obj = User(**user)
+    # Never serve a cached entry past the token's own expiry
+    _tok_cache[token_hash] = (user_obj, payload.get("exp", 0))
+    return user_obj
+
+# Move documents created with a separate "id" field onto a UUID "_id".
+# Runs once (recorded in db.migrations); safe to run concurrently from several
+# workers and to re-run after an interrupted attempt.
+LEGACY_IDS_MIGRATION = "legacy_ids"
+
+async def migrate_legacy_ids():
+    if await db.migrations.find_one({"_id": LEGACY_IDS_MIGRATION}):
+        return
+    
+    # The old unique "id" index would reject every new document (id: null), and the
+    # email index would reject each copy while its original still exists.
+    # init_indexes recreates the email index afterwards.
+    legacy_indexes = ((db.users, ["id_1", "email_1"]), (db.visits, ["id_1"]))
+    for collection, index_names in legacy_indexes:
+        for index_name in index_names:
+            try:
+                await collection.drop_index(index_name)
+            except OperationFailure:
+                pass  # never existed or already dropped by another worker
+        
+        async for doc in collection.find({"id": {"$exists": True}}):
+            old_object_id = doc.pop("_id")
+            # Keep the old id value so created_by/approved_by references stay valid
+            doc["_id"] = doc.pop("id")
+            # Write the copy before removing the original so a crash loses nothing
+            try:
+                await collection.insert_one(doc)
+            except DuplicateKeyError:
+                # Already copied by another worker or an earlier attempt
+                if await collection.find_one({"_id": doc["_id"]}) is None:
+                    raise
+            await collection.delete_one({"_id": old_object_id})
+    
+    await db.migrations.update_one(
+        {"_id": LEGACY_IDS_MIGRATION},
+        {"$set": {"completed_at": utc_now()}},
+        upsert=True
+    )
+
+# Create indexes used by login, visit lookups and dashboard stats
+async def init_indexes():
+    await db.users.create_index("email", unique=True)
+    await db.visits.create_index([("entry_time", -1)])
+    # Covers the visitors_inside count (status + exit_time)
+    await db.visits.create_index([("status", 1), ("exit_time", 1)])
 
 # Initialize default users
 async def init_default_users():
     # Check if users already exist
     existing_users = await db.users.count_documents({})
     if existing_users == 0:
+        # bcrypt is CPU-bound; hash in worker threads so startup isn't blocked
+        admin_hash, seg_hash, sind_hash = await asyncio.gather(
+            asyncio.to_thread(get_password_hash, "admin123"),
+            asyncio.to_thread(get_password_hash, "seg123"),
+            asyncio.to_thread(get_password_hash, "sind123"),
+        )
+        created_at = utc_now()
         default_users = [
             {
-                "id": str(uuid.uuid4()),
+                "_id": uuid.uuid4().hex,
                 "email": "admin@guardiao.com",
                 "name": "Administrador",
                 "role": "Administrador",
-                "password_hash": get_password_hash("admin123"),
-                "created_at": datetime.utcnow(),
+                "password_hash": admin_hash,
+                "created_at": created_at,
                 "is_active": True
             },
             {
-                "id": str(uuid.uuid4()),
+                "_id": uuid.uuid4().hex,
                 "email": "seguranca@guardiao.com",
                 "name": "Segurança",
                 "role": "Segurança",
-                "password_hash": get_password_hash("seg123"),
-                "created_at": datetime.utcnow(),
+                "password_hash": seg_hash,
+                "created_at": created_at,
                 "is_active": True
             },
             {
-                "id": str(uuid.uuid4()),
+                "_id": uuid.uuid4().hex,
                 "email": "sindico@guardiao.com",
                 "name": "Síndico",
                 "role": "Síndico",
-                "password_hash": get_password_hash("sind123"),
-                "created_at": datetime.utcnow(),
+                "password_hash": sind_hash,
+                "created_at": created_at,
                 "is_active": True
             }
         ]
-        await db.users.insert_many(default_users)
+        try:
+            await db.users.insert_many(default_users, ordered=False)
+        except BulkWriteError as e:
+            # Another worker seeded the same users concurrently
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
         print("Default users created successfully!")
 
 # Authentication Routes
 @api_router.post("/auth/login", response_model=Token)
 async def login(user_credentials: UserLogin):
     user = await db.users.find_one({"email": user_credentials.email})
-    if not user or not verify_password(user_credentials.password, user["password_hash"]):
+    password_hash = user["password_hash"] if user else _DUMMY_HASH
+    password_ok = await asyncio.to_thread(verify_password, user_credentials.password, password_hash)
+    if not user or not password_ok:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Credenciais inválidas",
@@ -197,8 +323,16 @@ async def login(user_credentials: UserLogin):
             detail="Usuário desativado"
         )
     
-    access_token = create_access_token(data={"sub": user["id"]})
-    user_response = UserResponse(**user)
+    # Migrate legacy raw-bcrypt hashes now that we have the plaintext
+    if password_needs_rehash(user["password_hash"]):
+        new_hash = await asyncio.to_thread(get_password_hash, user_credentials.password)
+        await db.users.update_one(
+            {"_id": user["_id"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+    
+    access_token = create_access_token(data={"sub": user["_id"]})
+    user_response = UserResponse.model_construct(**user)
     
     return Token(access_token=access_token, user=user_response)
 
@@ -221,15 +355,16 @@ async def register(user_data: UserCreate, current_user: User = Depends(get_curre
     
     # Create new user
     user_dict = user_data.dict()
-    user_dict["password_hash"] = get_password_hash(user_dict.pop("password"))
+    user_dict["password_hash"] = await asyncio.to_thread(get_password_hash, user_dict.pop("password"))
     user_obj = User(**user_dict)
     
-    await db.users.insert_one(user_obj.dict())
-    return UserResponse(**user_obj.dict())
+    user_doc = user_obj.dict(by_alias=True)
+    await db.users.insert_one(user_doc)
+    return UserResponse.model_construct(**user_doc)
 
 @api_router.get("/auth/me", response_model=UserResponse)
 async def get_current_user_info(current_user: User = Depends(get_current_user)):
-    return UserResponse(**current_user.dict())
+    return UserResponse.model_construct(**current_user.dict())
 
 # Visit Routes
 @api_router.post("/visits", response_model=VisitResponse)
@@ -238,48 +373,52 @@ async def create_visit(visit_data: VisitCreate, current_user: User = Depends(get
     visit_dict["created_by"] = current_user.id
     visit_obj = Visit(**visit_dict)
     
-    await db.visits.insert_one(visit_obj.dict())
-    return VisitResponse(**visit_obj.dict())
+    visit_doc = visit_obj.dict(by_alias=True)
+    await db.visits.insert_one(visit_doc)
+    return VisitResponse.model_construct(**visit_doc)
 
 @api_router.get("/visits", response_model=List[VisitResponse])
-async def get_visits(current_user: User = Depends(get_current_user)):
-    visits = await db.visits.find().sort("entry_time", -1).to_list(1000)
-    return [VisitResponse(**visit) for visit in visits]
+async def get_visits(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(1000, ge=1, le=1000),
+    current_user: User = Depends(get_current_user)
+):
+    cursor = db.visits.find({}, projection=VISIT_RESPONSE_PROJECTION)
+    cursor = cursor.sort("entry_time", -1).skip(skip).limit(limit)
+    # Documents were written through our own models, so skip re-validation
+    return [VisitResponse.model_construct(**visit) async for visit in cursor]
 
 @api_router.get("/visits/{visit_id}", response_model=VisitResponse)
 async def get_visit(visit_id: str, current_user: User = Depends(get_current_user)):
-    visit = await db.visits.find_one({"id": visit_id})
+    visit = await db.visits.find_one({"_id": visit_id})
     if not visit:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Visita não encontrada"
         )
-    return VisitResponse(**visit)
+    return VisitResponse.model_construct(**visit)
 
 @api_router.put("/visits/{visit_id}", response_model=VisitResponse)
 async def update_visit(visit_id: str, visit_update: VisitUpdate, current_user: User = Depends(get_current_user)):
-    visit = await db.visits.find_one({"id": visit_id})
-    if not visit:
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail="Visita não encontrada"
-        )
-    
     update_data = visit_update.dict(exclude_unset=True)
     
     if visit_update.status in ["approved", "denied"]:
         update_data["approved_by"] = current_user.id
     
     if visit_update.status == "completed":
-        update_data["exit_time"] = datetime.utcnow()
+        update_data["exit_time"] = utc_now()
     
-    await db.visits.update_one(
-        {"id": visit_id},
-        {"$set": update_data}
+    updated_visit = await db.visits.find_one_and_update(
+        {"_id": visit_id},
+        {"$set": update_data},
+        return_document=ReturnDocument.AFTER
     )
-    
-    updated_visit = await db.visits.find_one({"id": visit_id})
-    return VisitResponse(**updated_visit)
+    if not updated_visit:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Visita não encontrada"
+        )
+    return VisitResponse.model_construct(**updated_visit)
 
 @api_router.delete("/visits/{visit_id}")
 async def delete_visit(visit_id: str, current_user: User = Depends(get_current_user)):
@@ -289,7 +428,7 @@ async def delete_visit(visit_id: str, current_user: User = Depends(get_current_u
             detail="Acesso negado. Apenas administradores e síndicos podem deletar visitas."
         )
     
-    result = await db.visits.delete_one({"id": visit_id})
+    result = await db.visits.delete_one({"_id": visit_id})
     if result.deleted_count == 0:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -301,54 +440,72 @@ async def delete_visit(visit_id: str, current_user: User = Depends(get_current_u
 # Dashboard Statistics
 @api_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: User = Depends(get_current_user)):
-    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    today = utc_now().replace(hour=0, minute=0, second=0, microsecond=0)
     
-    # Total visits today
-    visits_today = await db.visits.count_documents({
-        "entry_time": {"$gte": today}
-    })
+    today_filter = {"entry_time": {"$gte": today}}
+    pending_filter = {"status": "pending"}
+    inside_filter = {"status": "approved", "exit_time": None}
     
-    # Pending visits
-    pending_visits = await db.visits.count_documents({
-        "status": "pending"
-    })
+    # All three counts in one aggregation. $facet itself cannot use indexes,
+    # so the leading $or narrows the input to index-matched documents first.
+    counts_pipeline = [
+        {"$match": {"$or": [today_filter, pending_filter, inside_filter]}},
+        {"$facet": {
+            # Total visits today
+            "today": [{"$match": today_filter}, {"$count": "n"}],
+            # Pending visits
+            "pending": [{"$match": pending_filter}, {"$count": "n"}],
+            # Total visitors inside (approved but not completed)
+            "inside": [{"$match": inside_filter}, {"$count": "n"}],
+        }},
+    ]
     
-    # Total visitors inside (approved but not completed)
-    visitors_inside = await db.visits.count_documents({
-        "status": "approved",
-        "exit_time": None
-    })
+    counts, recent_visits = await asyncio.gather(
+        db.visits.aggregate(counts_pipeline).to_list(1),
+        # Recent visits (last 10), kept separate so it walks the entry_time index
+        db.visits.find().sort("entry_time", -1).limit(10).to_list(10),
+    )
+    counts = counts[0]
     
-    # Recent visits (last 10)
-    recent_visits = await db.visits.find().sort("entry_time", -1).limit(10).to_list(10)
+    def facet_count(name):
+        return counts[name][0]["n"] if counts[name] else 0
     
     return {
-        "visits_today": visits_today,
-        "pending_visits": pending_visits,
-        "visitors_inside": visitors_inside,
-        "recent_visits": [VisitResponse(**visit) for visit in recent_visits]
+        "visits_today": facet_count("today"),
+        "pending_visits": facet_count("pending"),
+        "visitors_inside": facet_count("inside"),
+        "recent_visits": [VisitResponse.model_construct(**visit) for visit in recent_visits]
     }
 
 # Health check
 @api_router.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    return {"status": "healthy", "timestamp": utc_now()}
 
 # Initialize on startup
 @app.on_event("startup")
 async def startup_event():
+    # Open the pool before the first request arrives
+    await client.admin.command("ping")
+    await migrate_legacy_ids()
+    await init_indexes()
     await init_default_users()
     print("GUARDIÃO API initialized successfully!")
 
 # Include the router in the main app
 app.include_router(api_router)
 
+CORS_ORIGINS = [
+    origin.strip() for origin in os.environ.get('CORS_ORIGINS', '*').split(',') if origin.strip()
+]
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
-    allow_origins=["*"],
+    allow_origins=CORS_ORIGINS,
     allow_methods=["*"],
     allow_headers=["*"],
+    max_age=86400,  # let browsers cache preflight responses for a day
 )
 
 # Configure logging
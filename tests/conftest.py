@@ -0,0 +1,24 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+from tests.fakes import FakeDB  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def fast_bcrypt(monkeypatch):
+    monkeypatch.setattr(server, "BCRYPT_ROUNDS", 4)
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    """Install a FakeDB built from the given collections as server.db."""
+    def install(**collections):
+        db = FakeDB(**collections)
+        monkeypatch.setattr(server, "db", db)
+        return db
+    return install
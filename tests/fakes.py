@@ -0,0 +1,70 @@
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+
+def _matches(doc, query):
+    for key, value in query.items():
+        if isinstance(value, dict) and "$exists" in value:
+            if (key in doc) != value["$exists"]:
+                return False
+        elif doc.get(key) != value:
+            return False
+    return True
+
+
+class FakeCollection:
+    """In-memory stand-in for the few Motor collection methods server.py uses."""
+
+    def __init__(self, docs=(), indexes=(), insert_many_error_codes=None):
+        self.docs = {doc["_id"]: dict(doc) for doc in docs}
+        self.indexes = set(indexes)
+        self.insert_many_error_codes = insert_many_error_codes
+
+    async def find_one(self, query):
+        for doc in self.docs.values():
+            if _matches(doc, query):
+                return dict(doc)
+        return None
+
+    def find(self, query):
+        async def cursor():
+            for doc in list(self.docs.values()):
+                if _matches(doc, query):
+                    yield dict(doc)
+        return cursor()
+
+    async def count_documents(self, query):
+        return sum(1 for doc in self.docs.values() if _matches(doc, query))
+
+    async def insert_one(self, doc):
+        if doc["_id"] in self.docs:
+            raise DuplicateKeyError("E11000 duplicate key error")
+        self.docs[doc["_id"]] = dict(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        if self.insert_many_error_codes:
+            raise BulkWriteError({"writeErrors": [
+                {"index": i, "code": code} for i, code in enumerate(self.insert_many_error_codes)
+            ]})
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+    async def update_one(self, query, update, upsert=False):
+        if upsert:
+            self.docs.setdefault(query["_id"], {"_id": query["_id"]})
+        self.docs[query["_id"]].update(update["$set"])
+
+    async def drop_index(self, name):
+        if name not in self.indexes:
+            raise OperationFailure("index not found", code=27)
+        self.indexes.remove(name)
+
+
+class FakeDB:
+    def __init__(self, **collections):
+        self.collections = collections
+
+    def __getattr__(self, name):
+        return self.collections.setdefault(name, FakeCollection())
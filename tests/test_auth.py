@@ -0,0 +1,79 @@
+import bcrypt
+import pytest
+from fastapi.testclient import TestClient
+
+import server
+from tests.fakes import FakeCollection
+
+
+def make_user(password_hash):
+    return {
+        "_id": "u1",
+        "email": "user@guardiao.com",
+        "name": "Usuário",
+        "role": "Segurança",
+        "password_hash": password_hash,
+        "created_at": server.utc_now(),
+        "is_active": True,
+    }
+
+
+def legacy_hash(password):
+    # What passlib stored: raw bcrypt, truncated by bcrypt to 72 bytes
+    return bcrypt.hashpw(password.encode()[:72], bcrypt.gensalt(rounds=4)).decode()
+
+
+@pytest.fixture
+def login(fake_db):
+    def _login(user, password, email="user@guardiao.com"):
+        db = fake_db(users=FakeCollection([user]))
+        response = TestClient(server.app).post(
+            "/api/auth/login", json={"email": email, "password": password}
+        )
+        return response, db.users.docs[user["_id"]]
+    return _login
+
+
+def test_new_hash_verifies():
+    hashed = server.get_password_hash("seg123")
+    assert hashed.startswith(server.PREHASH_PREFIX)
+    assert server.verify_password("seg123", hashed)
+    assert not server.verify_password("seg124", hashed)
+    assert not server.password_needs_rehash(hashed)
+
+
+def test_long_password_is_not_truncated():
+    password = "a" * 100
+    hashed = server.get_password_hash(password)
+    assert server.verify_password(password, hashed)
+    assert not server.verify_password("a" * 72, hashed)
+
+
+def test_legacy_hash_verifies_long_password():
+    password = "b" * 100
+    assert server.verify_password(password, legacy_hash(password))
+
+
+def test_login_rehashes_legacy_hash(login):
+    response, stored = login(make_user(legacy_hash("seg123")), "seg123")
+    assert response.status_code == 200
+    assert response.json()["user"]["id"] == "u1"
+    assert stored["password_hash"].startswith(server.PREHASH_PREFIX)
+    assert server.verify_password("seg123", stored["password_hash"])
+
+
+def test_login_keeps_new_hash(login):
+    password_hash = server.get_password_hash("seg123")
+    response, stored = login(make_user(password_hash), "seg123")
+    assert response.status_code == 200
+    assert stored["password_hash"] == password_hash
+
+
+def test_login_long_password_against_legacy_hash(login):
+    response, _ = login(make_user(legacy_hash("seg123")), "c" * 100)
+    assert response.status_code == 401
+
+
+def test_login_unknown_email(login):
+    response, _ = login(make_user(legacy_hash("seg123")), "seg123", email="nobody@guardiao.com")
+    assert response.status_code == 401
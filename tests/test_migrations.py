@@ -0,0 +1,43 @@
+import asyncio
+
+from bson import ObjectId
+
+import server
+from tests.fakes import FakeCollection
+
+
+def test_migrate_legacy_ids(fake_db):
+    user_object_id, visit_object_id = ObjectId(), ObjectId()
+    db = fake_db(
+        users=FakeCollection(
+            [{"_id": user_object_id, "id": "user-1", "email": "a@guardiao.com"}],
+            indexes=["id_1", "email_1"],
+        ),
+        visits=FakeCollection(
+            [{"_id": visit_object_id, "id": "visit-1", "created_by": "user-1"}],
+            indexes=["id_1"],
+        ),
+    )
+
+    asyncio.run(server.migrate_legacy_ids())
+
+    assert db.users.docs == {"user-1": {"_id": "user-1", "email": "a@guardiao.com"}}
+    assert db.visits.docs == {"visit-1": {"_id": "visit-1", "created_by": "user-1"}}
+    assert db.users.indexes == set()
+    assert server.LEGACY_IDS_MIGRATION in db.migrations.docs
+
+    # Recorded as done, so a second run is a no-op
+    asyncio.run(server.migrate_legacy_ids())
+
+
+def test_migrate_legacy_ids_resumes_after_partial_copy(fake_db):
+    object_id = ObjectId()
+    # An interrupted run copied the document but never removed the original
+    db = fake_db(users=FakeCollection([
+        {"_id": object_id, "id": "user-1", "email": "a@guardiao.com"},
+        {"_id": "user-1", "email": "a@guardiao.com"},
+    ]))
+
+    asyncio.run(server.migrate_legacy_ids())
+
+    assert db.users.docs == {"user-1": {"_id": "user-1", "email": "a@guardiao.com"}}
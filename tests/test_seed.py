@@ -0,0 +1,18 @@
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+import server
+from tests.fakes import FakeCollection
+
+
+def test_init_default_users_ignores_concurrent_seed(fake_db):
+    fake_db(users=FakeCollection(insert_many_error_codes=[11000, 11000, 11000]))
+    asyncio.run(server.init_default_users())
+
+
+def test_init_default_users_reraises_other_errors(fake_db):
+    fake_db(users=FakeCollection(insert_many_error_codes=[11000, 121]))
+    with pytest.raises(BulkWriteError):
+        asyncio.run(server.init_default_users())